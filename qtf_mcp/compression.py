@@ -0,0 +1,215 @@
+import gzip
+import logging
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict
+
+import pydantic_core
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger("qtf_mcp")
+
+try:
+  from compression import zstd  # type: ignore  # Python 3.14+
+
+  def zstd_compress(data: bytes, level: int) -> bytes:
+    return zstd.compress(data, level)
+except ImportError:
+  try:
+    import zstandard  # type: ignore
+
+    def zstd_compress(data: bytes, level: int) -> bytes:
+      return zstandard.ZstdCompressor(level=level).compress(data)
+  except ImportError:
+    zstd_compress = None  # type: ignore
+
+
+def gzip_compress(data: bytes, level: int) -> bytes:
+  return gzip.compress(data, level, mtime=0)
+
+
+# gzip member header: deflate, no flags, no mtime, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def deflate(data: bytes, level: int, final: bool, zdict: bytes = b"") -> bytes:
+  """
+  raw deflate segment, a non final segment ends on a byte boundary (sync flush)
+  so another independently deflated segment can follow it. `zdict` must be the data
+  right before this segment, it lets the segment refer back to it
+  """
+  if zdict:
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict[-32768:])
+  else:
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+  return c.compress(data) + c.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def gzip_splice(body: bytes, parts: list[bytes], segments: list[bytes], level: int) -> bytes:
+  """
+  a single gzip member of body, made of parts joined by already deflated segments,
+  only parts are compressed. concatenated gzip members would be simpler but some
+  clients (httpx) read the first only
+  """
+  out = [GZIP_HEADER]
+  for i, part in enumerate(parts):
+    if i > 0:
+      out.append(segments[i - 1])
+    out.append(deflate(part, level, i == len(parts) - 1))
+  out.append(struct.pack("<II", zlib.crc32(body), len(body) & 0xFFFFFFFF))
+  return b"".join(out)
+
+
+# encoding -> (compress function, level), in order of preference
+ENCODERS: Dict[str, tuple[Callable[[bytes, int], bytes], int]] = {}
+if zstd_compress is not None:
+  ENCODERS["zstd"] = (zstd_compress, 3)
+ENCODERS["gzip"] = (gzip_compress, 6)
+
+
+def accepted_encodings(accept_encoding: str) -> list[str]:
+  """
+  encodings the client accepts, in order of preference.
+  an explicit q=0 rejects an encoding even when "*" is accepted
+  """
+  accepted = set()
+  rejected = set()
+  for item in accept_encoding.lower().split(","):
+    name, *params = [p.strip() for p in item.split(";")]
+    if name == "":
+      continue
+    q = 1.0
+    for param in params:
+      key, _, value = param.partition("=")
+      if key.strip() == "q":
+        try:
+          q = float(value)
+        except ValueError:
+          q = 0
+    if q > 0:
+      accepted.add(name)
+    else:
+      rejected.add(name)
+  return [
+    encoding
+    for encoding in ENCODERS
+    if encoding not in rejected and (encoding in accepted or "*" in accepted)
+  ]
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+  """
+  pick the preferred encoding the client accepts, None for identity
+  """
+  encodings = accepted_encodings(accept_encoding)
+  return encodings[0] if encodings else None
+
+
+class CompressionMiddleware:
+  """
+  compress complete responses of at least `minimum_size` bytes with zstd or gzip,
+  streamed responses (text/event-stream) are passed through unchanged.
+
+  tools leave the data version and the text of their report in the request state. the
+  deflated JSON string of that report is cached per data version, so a later response with
+  the same report, whatever its JSON-RPC id, only compresses the envelope around it and
+  splices the cached segment in. zstd frames can not be spliced into one frame, so such
+  responses use gzip whenever the client accepts it
+  """
+
+  def __init__(self, app: ASGIApp, minimum_size: int = 1024, cache_size: int = 256):
+    self.app = app
+    self.minimum_size = minimum_size
+    self.cache_size = cache_size
+    # data version -> (report as a JSON string, its deflate segment, repeated segments)
+    self.payloads: OrderedDict[str, tuple[bytes, bytes, Dict[bytes, bytes]]] = OrderedDict()
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    encodings = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+    if len(encodings) == 0:
+      await self.app(scope, receive, send)
+      return
+
+    start: Message | None = None
+    chunks: list[bytes] = []
+    passthrough = False
+
+    async def send_wrapper(message: Message) -> None:
+      nonlocal start, passthrough
+      if passthrough:
+        await send(message)
+        return
+      if message["type"] == "http.response.start":
+        headers = Headers(raw=message["headers"])
+        if "content-encoding" in headers or headers.get("content-type", "").startswith(
+          "text/event-stream"
+        ):
+          passthrough = True
+          await send(message)
+        else:
+          start = message
+        return
+      if message["type"] != "http.response.body" or start is None:
+        await send(message)
+        return
+      chunks.append(message.get("body", b""))
+      if message.get("more_body", False):
+        return
+      await self.send_body(scope, send, start, b"".join(chunks), encodings)
+
+    await self.app(scope, receive, send_wrapper)
+
+  async def send_body(
+    self, scope: Scope, send: Send, start: Message, body: bytes, encodings: list[str]
+  ) -> None:
+    headers = MutableHeaders(raw=start["headers"])
+    if len(body) >= self.minimum_size:
+      encoding, body = self.compress(scope, body, encodings)
+      headers["content-encoding"] = encoding
+      headers["content-length"] = str(len(body))
+      headers.add_vary_header("Accept-Encoding")
+    await send(start)
+    await send({"type": "http.response.body", "body": body})
+
+  def compress(self, scope: Scope, body: bytes, encodings: list[str]) -> tuple[str, bytes]:
+    state = scope.get("state", None) or {}
+    version = state.get("data_version", None)
+    report = state.get("report", None)
+    if version is not None and report is not None and "gzip" in encodings:
+      spliced = self.splice(version, report, body)
+      if spliced is not None:
+        return "gzip", spliced
+    compress, level = ENCODERS[encodings[0]]
+    return encodings[0], compress(body, level)
+
+  def splice(self, version: str, report: str, body: bytes) -> bytes | None:
+    _, level = ENCODERS["gzip"]
+    payload = self.payloads.get(version, None)
+    if payload is None:
+      escaped = pydantic_core.to_json(report)
+      payload = (escaped, deflate(escaped, level, False), {})
+      self.payloads[version] = payload
+      while len(self.payloads) > self.cache_size:
+        self.payloads.popitem(last=False)
+    else:
+      self.payloads.move_to_end(version)
+    escaped, first, repeats = payload
+    parts = body.split(escaped)
+    if len(parts) < 2:
+      return None
+    segments = [first]
+    # a tool result carries the report twice (content and structuredContent), a repeat is
+    # deflated against the report and the envelope between them, which is the same every time
+    for between in parts[1:-1]:
+      segment = repeats.get(between, None)
+      if segment is None:
+        segment = deflate(escaped, level, False, escaped + between)
+        if len(repeats) < 4:
+          repeats[between] = segment
+      segments.append(segment)
+    return gzip_splice(body, parts, segments, level)
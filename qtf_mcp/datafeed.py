@@ -1,12 +1,17 @@
+import asyncio
 import json
 import logging
 import os
+import threading
 import time
+from collections import OrderedDict
 from typing import Dict, List
 
 import numpy as np
 from qtf import msd_fetch_once, pre_adjustment
 
+from .resilience import CircuitBreaker, ResilientFetcher
+
 logger = logging.getLogger("qtf_mcp")
 
 msd_host = os.environ.get("MSD_HOST", "")
@@ -16,6 +21,24 @@ if msd_host == "":
   logger.error("MSD_HOST is not set")
   raise ValueError("MSD_HOST is not set")
 
+msd_fetch = ResilientFetcher(
+  msd_fetch_once,
+  timeout=float(os.environ.get("MSD_TIMEOUT", "10")),
+  total_timeout=float(os.environ.get("MSD_TOTAL_TIMEOUT", "15")),
+  retries=int(os.environ.get("MSD_RETRIES", "2")),
+  hedge_delay=float(os.environ.get("MSD_HEDGE_DELAY", "1")),
+  breaker=CircuitBreaker(
+    threshold=int(os.environ.get("MSD_BREAKER_THRESHOLD", "5")),
+    cooldown=float(os.environ.get("MSD_BREAKER_COOLDOWN", "30")),
+  ),
+  max_running=int(os.environ.get("MSD_MAX_RUNNING", "16")),
+)
+
+# (symbol, start date, end date) -> (fetch time, data), the last known good data served when MSD fails
+LAST_GOOD: OrderedDict[tuple[str, str, str], tuple[float, Dict[str, np.ndarray]]] = OrderedDict()
+LAST_GOOD_SIZE = int(os.environ.get("MSD_STALE_CACHE_SIZE", "512"))
+LAST_GOOD_LOCK = threading.Lock()
+
 
 STOCK_SECTOR: Dict[str, List[str]] | None = None
 
@@ -32,7 +55,7 @@ async def load_data_msd(
   symbol: str, start_date: str, end_date: str, n: int = 0, who: str = ""
 ) -> Dict[str, np.ndarray]:
   # logger.info(f"align data {symbol} cost {t3 - t2} seconds")
-  datas = load_data_msd_batch([symbol], start_date, end_date, n, who)
+  datas = await asyncio.to_thread(load_data_msd_batch, [symbol], start_date, end_date, n, who)
 
   return datas.get(symbol, {})
 
@@ -71,7 +94,14 @@ def load_data_msd_batch(
 
   # fetch all data
   t1 = time.time()
-  raw_datas = msd_fetch_once("msd://" + msd_host, sqls)
+  try:
+    raw_datas = msd_fetch("msd://" + msd_host, sqls)
+  except Exception:
+    stale = load_last_good(symbols, start_date, end_date)
+    if len(stale) == 0:
+      raise
+    logger.warning(f"{who} fetch data failed, serve stale data, symbols: {','.join(stale)}", exc_info=True)
+    return stale
   t2 = time.time()
   logger.info(f"{who} fetch data cost {t2 - t1} seconds, symbols: {','.join(symbols)}")
 
@@ -178,5 +208,210 @@ def load_data_msd_batch(
       symbol_data["_DS_FUNDFLOW"] = (fund_flow, "1d")
 
     datas[k] = symbol_data
+    save_last_good(k, start_date, end_date, symbol_data)
 
   return datas
+
+
+def save_last_good(symbol: str, start_date: str, end_date: str, data: Dict[str, np.ndarray]):
+  key = (symbol, start_date, end_date)
+  with LAST_GOOD_LOCK:
+    LAST_GOOD[key] = (time.time(), data)
+    LAST_GOOD.move_to_end(key)
+    while len(LAST_GOOD) > LAST_GOOD_SIZE:
+      LAST_GOOD.popitem(last=False)
+
+
+def covers(
+  cached_start: str, cached_end: str, fetched_at: float, start_date: str, end_date: str
+) -> bool:
+  """
+  whether cached data can stand in for a request, its history must reach back to start_date
+  and it must end at end_date, or both must be open ended (end after the day they were made)
+  """
+  if cached_start > start_date:
+    return False
+  if cached_end == end_date:
+    return True
+  fetched_day = time.strftime("%Y-%m-%d", time.localtime(fetched_at))
+  today = time.strftime("%Y-%m-%d")
+  return cached_end > fetched_day and end_date > today
+
+
+def load_last_good(
+  symbols: List[str], start_date: str, end_date: str
+) -> Dict[str, Dict[str, np.ndarray]]:
+  """
+  return the newest last known good data of symbols covering the requested range,
+  marked with "_STALE" = fetch time
+  """
+  with LAST_GOOD_LOCK:
+    entries = list(LAST_GOOD.items())
+
+  datas = {}
+  for (symbol, cached_start, cached_end), (fetched_at, data) in reversed(entries):
+    if symbol not in symbols or symbol in datas:
+      continue
+    if not covers(cached_start, cached_end, fetched_at, start_date, end_date):
+      continue
+    stale = dict(data)
+    stale["_STALE"] = fetched_at  # type: ignore
+    datas[symbol] = stale
+  return datas
+
+
+# A-share trading dates are stored as epoch nanoseconds at local (UTC+8) midnight
+CN_TZ_OFFSET = np.timedelta64(8, "h")
+
+# fields aligned with the daily kline that are not plain "last value" fields
+RESAMPLE_FIRST = {"OPEN"}
+RESAMPLE_MAX = {"HIGH"}
+RESAMPLE_MIN = {"LOW"}
+RESAMPLE_SUM = {"VOLUME", "AMOUNT", "GCASH", "GSHARE"}
+KLINE_EXTRA_FIELDS = ["CLOSE2", "PRICE", "GCASH", "GSHARE"]
+
+
+def period_starts(dates: np.ndarray, timeframe: str) -> np.ndarray:
+  """
+  return the index of the first bar of every week ("1w") or month ("1M") in dates
+  """
+  days = (dates.astype(np.int64).astype("datetime64[ns]") + CN_TZ_OFFSET).astype("datetime64[D]")
+  if timeframe == "1w":
+    # datetime64[W] weeks begin on Thursday (1970-01-01), shift so weeks begin on Monday
+    keys = (days + np.timedelta64(3, "D")).astype("datetime64[W]")
+  elif timeframe == "1M":
+    keys = days.astype("datetime64[M]")
+  else:
+    raise ValueError(f"unsupported timeframe: {timeframe}")
+  if len(keys) == 0:
+    return np.zeros(0, dtype=np.intp)
+  return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+def resample_arrays(
+  arrays: Dict[str, np.ndarray], starts: np.ndarray
+) -> Dict[str, np.ndarray]:
+  """
+  aggregate bar arrays into periods beginning at starts, DATE is the last bar of the period
+  """
+  n = len(arrays["DATE"])
+  ends = np.append(starts[1:], n) - 1
+  out = {}
+  for field, arr in arrays.items():
+    if field in RESAMPLE_FIRST:
+      out[field] = arr[starts]
+    elif field in RESAMPLE_MAX:
+      out[field] = np.maximum.reduceat(arr, starts)
+    elif field in RESAMPLE_MIN:
+      out[field] = np.minimum.reduceat(arr, starts)
+    elif field in RESAMPLE_SUM or field.endswith("_A"):
+      out[field] = np.add.reduceat(np.nan_to_num(arr), starts)
+    else:
+      out[field] = arr[ends]
+  return out
+
+
+def resample_fund_flow(fund_flow: Dict[str, np.ndarray], timeframe: str) -> Dict[str, np.ndarray]:
+  """
+  sum fund flow amounts per period, ratios are rebuilt as summed amount / summed base
+  where the daily base is amount / ratio
+  """
+  starts = period_starts(fund_flow["DATE"], timeframe)
+  out = resample_arrays(fund_flow, starts)
+  for field, ratio in fund_flow.items():
+    if not field.endswith("_R"):
+      continue
+    amount = fund_flow.get(field[:-2] + "_A", None)
+    if amount is None:
+      continue
+    base = np.divide(
+      np.abs(amount), np.abs(ratio), out=np.zeros(len(ratio)), where=ratio != 0
+    )
+    base_sum = np.add.reduceat(np.nan_to_num(base), starts)
+    out[field] = np.divide(
+      out[field[:-2] + "_A"], base_sum, out=np.zeros(len(starts)), where=base_sum != 0
+    )
+  return out
+
+
+def last_value(arrays: Dict[str, np.ndarray], field: str) -> float | None:
+  arr = arrays.get(field, None)
+  if arr is None or len(arr) == 0:
+    return None
+  return float(arr[-1])
+
+
+def resample_key(symbol: str, timeframe: str, data: Dict[str, np.ndarray]) -> tuple:
+  """
+  key of resampled bars, it changes with the daily range, the last daily bar and the last fund flow
+  """
+  dates = data["DATE"]
+  key = (
+    symbol,
+    timeframe,
+    len(dates),
+    int(dates[0]) if len(dates) > 0 else None,
+    last_value(data, "DATE"),
+    last_value(data, "CLOSE"),
+    last_value(data, "VOLUME"),
+  )
+  fund_flow_ds = data.get("_DS_FUNDFLOW", None)
+  if fund_flow_ds is not None:
+    fund_flow = fund_flow_ds[0]
+    key += (len(fund_flow["DATE"]), last_value(fund_flow, "DATE"), last_value(fund_flow, "A_A"))  # type: ignore
+  return key
+
+
+# resample_key -> resampled bars, shared across requests since daily data is fetched every time
+RESAMPLED: OrderedDict[tuple, Dict[str, np.ndarray]] = OrderedDict()
+RESAMPLED_SIZE = int(os.environ.get("RESAMPLE_CACHE_SIZE", "256"))
+RESAMPLED_LOCK = threading.Lock()
+
+
+def resample_bars(data: Dict[str, np.ndarray], timeframe: str) -> Dict[str, np.ndarray]:
+  """
+  resampled kline and fund flow fields of data, to be laid over the daily data
+  """
+  kline, _ = data["_DS_KLINE"]
+  daily = {field: data[field] for field in kline.keys()}
+  for field in KLINE_EXTRA_FIELDS:
+    if field in data:
+      daily[field] = data[field]
+
+  bars = resample_arrays(daily, period_starts(daily["DATE"], timeframe))
+  bars["_DS_KLINE"] = ({field: bars[field] for field in kline.keys()}, timeframe)  # type: ignore
+
+  fund_flow_ds = data.get("_DS_FUNDFLOW", None)
+  if fund_flow_ds is not None:
+    fund_flow = resample_fund_flow(fund_flow_ds[0], timeframe)
+    for field, arr in fund_flow.items():
+      if field != "DATE":
+        bars[field] = arr
+    bars["_DS_FUNDFLOW"] = (fund_flow, timeframe)  # type: ignore
+  return bars
+
+
+def resample_data(
+  symbol: str, data: Dict[str, np.ndarray], timeframe: str
+) -> Dict[str, np.ndarray]:
+  """
+  build weekly ("1w") or monthly ("1M") bars from the daily data of load_data_msd,
+  bars are cached by resample_key so a repeated request on unchanged data reuses them
+  """
+  if timeframe == "1d" or len(data) == 0:
+    return data
+  key = resample_key(symbol, timeframe, data)
+  with RESAMPLED_LOCK:
+    bars = RESAMPLED.get(key, None)
+    if bars is not None:
+      RESAMPLED.move_to_end(key)
+  if bars is None:
+    bars = resample_bars(data, timeframe)
+    with RESAMPLED_LOCK:
+      RESAMPLED[key] = bars
+      while len(RESAMPLED) > RESAMPLED_SIZE:
+        RESAMPLED.popitem(last=False)
+
+  resampled = dict(data)
+  resampled.update(bars)
+  return resampled
@@ -1,9 +1,51 @@
+import os
+from collections import OrderedDict
 from io import StringIO
+from typing import Annotated, Literal
 
 from mcp.server.fastmcp import Context, FastMCP
+from mcp.types import CallToolResult, TextContent
 from starlette.applications import Starlette
 from starlette.middleware.cors import CORSMiddleware
 from . import research
+from .compression import CompressionMiddleware
+
+Timeframe = Literal["1d", "1w", "1M"]
+
+# data version -> rendered report, see research.data_version
+REPORT_CACHE: OrderedDict[tuple, str] = OrderedDict()
+REPORT_CACHE_SIZE = int(os.environ.get("REPORT_CACHE_SIZE", "256"))
+
+
+def get_report(version: tuple) -> str | None:
+  report = REPORT_CACHE.get(version, None)
+  if report is not None:
+    REPORT_CACHE.move_to_end(version)
+  return report
+
+
+def save_report(version: tuple, report: str) -> str:
+  REPORT_CACHE[version] = report
+  while len(REPORT_CACHE) > REPORT_CACHE_SIZE:
+    REPORT_CACHE.popitem(last=False)
+  return report
+
+
+def tool_result(ctx: Context, version: tuple, report: str) -> CallToolResult:
+  """
+  wrap a report with its data version, clients get the version in _meta, and
+  CompressionMiddleware finds it in the request state to reuse the compressed report
+  """
+  tag = research.data_version_tag(version)
+  request = ctx.request_context.request
+  if request is not None:
+    request.state.data_version = tag  # type: ignore
+    request.state.report = report  # type: ignore
+  return CallToolResult(
+    content=[TextContent(type="text", text=report)],
+    structuredContent={"result": report},
+    _meta={"data_version": tag},
+  )
 
 
 class QtfMCP(FastMCP):
@@ -11,6 +53,11 @@ class QtfMCP(FastMCP):
   def streamable_http_app(self) -> Starlette:
     super_app = super().streamable_http_app()
     super_app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+    super_app.add_middleware(
+      CompressionMiddleware,
+      minimum_size=int(os.environ.get("HTTP_COMPRESS_MIN_SIZE", "1024")),
+      cache_size=int(os.environ.get("HTTP_COMPRESS_CACHE_SIZE", "256")),
+    )
     return super_app
 
 # Create an MCP server
@@ -20,50 +67,66 @@ mcp_app = QtfMCP(
   message_path="/cnstock/messages/",
   streamable_http_path="/cnstock/mcp",
   stateless_http=True,
+  json_response=True,
 )
 
 
 @mcp_app.tool()
-async def brief(symbol: str, ctx: Context) -> str:
+async def brief(
+  symbol: str, ctx: Context, timeframe: Timeframe = "1d"
+) -> Annotated[CallToolResult, str]:
   """Get brief information for a given stock symbol, including
   - basic data
   - trading data
   Args:
     symbol (str): Stock symbol, must be in the format of "SH000001" or "SZ000001", you should infer user inputs like stock name to stock symbol
+    timeframe (str): Bar period of trading data, "1d" daily, "1w" weekly, "1M" monthly
   """
   who = ctx.request_context.request.client.host  # type: ignore
-  raw_data = await research.load_raw_data(symbol, None, who)
-  buf = StringIO()
+  raw_data = await research.load_raw_data(symbol, None, who, timeframe)
   if len(raw_data) == 0:
     return "No data found for symbol: " + symbol
+  version = research.data_version("brief", symbol, timeframe, raw_data)
+  report = get_report(version)
+  if report is not None:
+    return tool_result(ctx, version, report)
+  buf = StringIO()
   research.build_basic_data(buf, symbol, raw_data)
-  research.build_trading_data(buf, symbol, raw_data)
-  """Get brief information for a given stock symbol"""
-  return buf.getvalue()
+  research.build_trading_data(buf, symbol, raw_data, timeframe)
+  return tool_result(ctx, version, save_report(version, buf.getvalue()))
 
 
 @mcp_app.tool()
-async def medium(symbol: str, ctx: Context) -> str:
+async def medium(
+  symbol: str, ctx: Context, timeframe: Timeframe = "1d"
+) -> Annotated[CallToolResult, str]:
   """Get medium information for a given stock symbol, including
   - basic data
   - trading data
   - financial data
   Args:
     symbol (str): Stock symbol, must be in the format of "SH000001" or "SZ000001", you infer convert user inputs like stock name to stock symbol
+    timeframe (str): Bar period of trading data, "1d" daily, "1w" weekly, "1M" monthly
   """
   who = ctx.request_context.request.client.host  # type: ignore
-  raw_data = await research.load_raw_data(symbol, None, who)
-  buf = StringIO()
+  raw_data = await research.load_raw_data(symbol, None, who, timeframe)
   if len(raw_data) == 0:
     return "No data found for symbol: " + symbol
+  version = research.data_version("medium", symbol, timeframe, raw_data)
+  report = get_report(version)
+  if report is not None:
+    return tool_result(ctx, version, report)
+  buf = StringIO()
   research.build_basic_data(buf, symbol, raw_data)
-  research.build_trading_data(buf, symbol, raw_data)
+  research.build_trading_data(buf, symbol, raw_data, timeframe)
   research.build_financial_data(buf, symbol, raw_data)
-  return buf.getvalue()
+  return tool_result(ctx, version, save_report(version, buf.getvalue()))
 
 
 @mcp_app.tool()
-async def full(symbol: str, ctx: Context) -> str:
+async def full(
+  symbol: str, ctx: Context, timeframe: Timeframe = "1d"
+) -> Annotated[CallToolResult, str]:
   """Get full information for a given stock symbol, including
   - basic data
   - trading data
@@ -71,14 +134,19 @@ async def full(symbol: str, ctx: Context) -> str:
   - technical analysis data
   Args:
     symbol (str): Stock symbol, must be in the format of "SH000001" or "SZ000001", you should infer user inputs like stock name to stock symbol
+    timeframe (str): Bar period of trading and technical data, "1d" daily, "1w" weekly, "1M" monthly
   """
   who = ctx.request_context.request.client.host  # type: ignore
-  raw_data = await research.load_raw_data(symbol, None, who)
-  buf = StringIO()
+  raw_data = await research.load_raw_data(symbol, None, who, timeframe)
   if len(raw_data) == 0:
     return "No data found for symbol: " + symbol
+  version = research.data_version("full", symbol, timeframe, raw_data)
+  report = get_report(version)
+  if report is not None:
+    return tool_result(ctx, version, report)
+  buf = StringIO()
   research.build_basic_data(buf, symbol, raw_data)
-  research.build_trading_data(buf, symbol, raw_data)
+  research.build_trading_data(buf, symbol, raw_data, timeframe)
   research.build_financial_data(buf, symbol, raw_data)
-  research.build_technical_data(buf, symbol, raw_data)
-  return buf.getvalue()
+  research.build_technical_data(buf, symbol, raw_data, timeframe)
+  return tool_result(ctx, version, save_report(version, buf.getvalue()))
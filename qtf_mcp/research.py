@@ -1,28 +1,40 @@
 import datetime
+import hashlib
 from io import StringIO
 from typing import Dict, TextIO
 
 import talib
-from numpy import ndarray
+from numpy import isnan, ndarray
 from qtf.indicators import KDJ, MACD
 
-from .datafeed import load_data_msd
+from .datafeed import load_data_msd, resample_data
 from .symbols import symbol_with_name
 
 
+# timeframe -> (current bar, bar unit, days of daily history to load)
+# weekly and monthly history covers about 150 bars, the longest indicator lookback
+# (MA(120), T3 BBands 114) plus the 30 rows of the technical table
+TIMEFRAMES = {
+  "1d": ("当日", "日", 365 * 2),
+  "1w": ("本周", "周", 365 * 3),
+  "1M": ("本月", "月", 365 * 13),
+}
+
+
 async def load_raw_data(
-  symbol: str, end_date=None, who: str = ""
+  symbol: str, end_date=None, who: str = "", timeframe: str = "1d"
 ) -> Dict[str, ndarray]:
   if end_date is None:
     end_date = datetime.datetime.now() + datetime.timedelta(days=1)
   if type(end_date) == str:
     end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
 
-  start_date = end_date - datetime.timedelta(days=365 * 2)
+  start_date = end_date - datetime.timedelta(days=TIMEFRAMES[timeframe][2])
 
-  return await load_data_msd(
+  data = await load_data_msd(
     symbol, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), 0, who
   )
+  return resample_data(symbol, data, timeframe)
 
 
 def is_stock(symbol: str) -> bool:
@@ -41,6 +53,44 @@ def build_stock_data(symbol: str, raw_data: Dict[str, ndarray]) -> str:
   return md.getvalue()
 
 
+def data_version(tool: str, symbol: str, timeframe: str, data: Dict[str, ndarray]) -> tuple:
+  """
+  key of a rendered report, it changes with the last bar, the last fund flow, the finance report
+  and stale marks
+  """
+  fin = data.get("_DS_FINANCE", None)
+  fin_date = int(fin[0]["DATE"][-1]) if fin is not None and len(fin[0]["DATE"]) > 0 else 0  # type: ignore
+  fund_flow = data.get("_DS_FUNDFLOW", None)
+  fund_flow_last = (0, 0.0)
+  if fund_flow is not None and len(fund_flow[0]["DATE"]) > 0:  # type: ignore
+    amount = fund_flow[0].get("A_A", None)  # type: ignore
+    fund_flow_last = (
+      int(fund_flow[0]["DATE"][-1]),  # type: ignore
+      float(amount[-1]) if amount is not None and len(amount) > 0 else 0.0,
+    )
+  return (
+    tool,
+    symbol,
+    timeframe,
+    int(data["DATE"][-1]),
+    float(data["CLOSE"][-1]),
+    float(data["VOLUME"][-1]),
+    fin_date,
+    fund_flow_last,
+    data.get("_STALE", None),
+  )
+
+
+def data_version_tag(version: tuple) -> str:
+  """
+  printable form of a data version, sent to clients in the _meta of tool results
+  """
+  tool, symbol, timeframe, last_date = version[:4]
+  date = datetime.datetime.fromtimestamp(last_date / 1e9).strftime("%Y-%m-%d")
+  digest = hashlib.blake2b(repr(version).encode(), digest_size=4).hexdigest()
+  return f"{tool}/{symbol}/{timeframe}/{date}/{digest}"
+
+
 def filter_sector(sectors: list[str]) -> list[str]:
   keywords = ["MSCI", "标普", "同花顺", "融资融券", "沪股通"]
   # return sectors not including keywords
@@ -87,6 +137,13 @@ def build_basic_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> None:
   print(f"- 股票代码: {symbol}", file=fp)
   print(f"- 股票名称: {name}", file=fp)
   print(f"- 数据日期: {data_date.strftime('%Y-%m-%d')}", file=fp)
+  stale = data.get("_STALE", None)
+  if stale is not None:
+    stale_dt = datetime.datetime.fromtimestamp(stale)  # type: ignore
+    print(
+      f"- 注意: 行情服务暂不可用, 以下为 {stale_dt.strftime('%Y-%m-%d %H:%M:%S')} 获取的缓存数据, 可能不是最新",
+      file=fp,
+    )
   print(f"- 行业概念: {sector}", file=fp)
   if is_stock(symbol):
     total_shares = data["TCAP"][-1]  # Convert to shares
@@ -155,10 +212,14 @@ def build_fund_flow(field: tuple[str, str], data: Dict[str, ndarray]) -> str:
   return f"- {kind} {in_out}: {amount:.2f}亿, 占比: {ratio:.2%}"
 
 
-def build_trading_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> None:
-  today_vol_est_ratio = today_volume_est_ratio(data)
+def build_trading_data(
+  fp: TextIO, symbol: str, data: Dict[str, ndarray], timeframe: str = "1d"
+) -> None:
+  current, unit, _ = TIMEFRAMES[timeframe]
+  # only a daily bar can be extrapolated from the trading minutes elapsed
+  today_vol_est_ratio = today_volume_est_ratio(data) if timeframe == "1d" else 1
   close = data["CLOSE"]
-  volume = data["VOLUME"]
+  volume = data["VOLUME"].copy()
   volume[-1] = volume[-1] * today_vol_est_ratio  # Adjust today's volume
   amount = data["AMOUNT"] / 1e8
   amount[-1] = amount[-1] * today_vol_est_ratio  # Adjust today's amount
@@ -171,36 +232,36 @@ def build_trading_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> Non
   print("", file=fp)
 
   print("## 价格", file=fp)
-  print(f"- 当日: {close[-1]:.3f} 最高: {high[-1]:.3f} 最低: {low[-1]:.3f}", file=fp)
+  print(f"- {current}: {close[-1]:.3f} 最高: {high[-1]:.3f} 最低: {low[-1]:.3f}", file=fp)
   for p in periods:
     print(
-      f"- {p}日均价: {close[-p:].mean():.3f} 最高: {high[-p:].max():.3f} 最低: {low[-p:].min():.3f}",
+      f"- {p}{unit}均价: {close[-p:].mean():.3f} 最高: {high[-p:].max():.3f} 最低: {low[-p:].min():.3f}",
       file=fp,
     )
   print("", file=fp)
 
   print("## 振幅", file=fp)
-  print(f"- 当日: {(high[-1] / low[-1] - 1):.2%}", file=fp)
+  print(f"- {current}: {(high[-1] / low[-1] - 1):.2%}", file=fp)
   for p in periods:
-    print(f"- {p}日振幅: {(high[-p:].max() / low[-p:].min() - 1):.2%}", file=fp)
+    print(f"- {p}{unit}振幅: {(high[-p:].max() / low[-p:].min() - 1):.2%}", file=fp)
   print("", file=fp)
 
   print("## 涨跌幅", file=fp)
-  print(f"- 当日: {(close[-1] / close[-2] - 1):.2%}", file=fp)
+  print(f"- {current}: {(close[-1] / close[-2] - 1):.2%}", file=fp)
   for p in periods:
-    print(f"- {p}日累计: {(close[-1] / close[-p] - 1) * 100:.2f}%", file=fp)
+    print(f"- {p}{unit}累计: {(close[-1] / close[-p] - 1) * 100:.2f}%", file=fp)
   print("", file=fp)
 
   print("## 成交量(万手)", file=fp)
-  print(f"- 当日: {volume[-1] / 1e6:.2f}", file=fp)
+  print(f"- {current}: {volume[-1] / 1e6:.2f}", file=fp)
   for p in periods:
-    print(f"- {p}日均量(万手): {volume[-p:].mean() / 1e6:.2f}", file=fp)
+    print(f"- {p}{unit}均量(万手): {volume[-p:].mean() / 1e6:.2f}", file=fp)
   print("", file=fp)
 
   print("## 成交额(亿)", file=fp)
-  print(f"- 当日: {amount[-1]:.2f}", file=fp)
+  print(f"- {current}: {amount[-1]:.2f}", file=fp)
   for p in periods:
-    print(f"- {p}日均额(亿): {amount[-p:].mean():.2f}", file=fp)
+    print(f"- {p}{unit}均额(亿): {amount[-p:].mean():.2f}", file=fp)
   print("", file=fp)
 
   print("## 资金流向", file=fp)
@@ -213,14 +274,17 @@ def build_trading_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> Non
   if is_stock(symbol):
     tcap = data["TCAP"]
     print("## 换手率", file=fp)
-    print(f"- 当日: {volume[-1] / tcap[-1]:.2%}", file=fp)
+    print(f"- {current}: {volume[-1] / tcap[-1]:.2%}", file=fp)
     for p in periods:
-      print(f"- {p}日均换手: {volume[-p:].mean() / tcap[-1]:.2%}", file=fp)
-      print(f"- {p}日总换手: {volume[-p:].sum() / tcap[-1]:.2%}", file=fp)
+      print(f"- {p}{unit}均换手: {volume[-p:].mean() / tcap[-1]:.2%}", file=fp)
+      print(f"- {p}{unit}总换手: {volume[-p:].sum() / tcap[-1]:.2%}", file=fp)
     print("", file=fp)
 
 
-def build_technical_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> None:
+def build_technical_data(
+  fp: TextIO, symbol: str, data: Dict[str, ndarray], timeframe: str = "1d"
+) -> None:
+  _, unit, _ = TIMEFRAMES[timeframe]
   close = data["CLOSE"]
   high = data["HIGH"]
   low = data["LOW"]
@@ -229,7 +293,7 @@ def build_technical_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> N
   if len(close) < 30:
     return
 
-  print("# 技术指标(最近30日)", file=fp)
+  print(f"# 技术指标(最近30{unit})", file=fp)
   print("", file=fp)
 
   kdj_k, kdj_d, kdj_j = KDJ(close, high, low, 9, 3)
@@ -270,6 +334,8 @@ def build_technical_data(fp: TextIO, symbol: str, data: Dict[str, ndarray]) -> N
     ("OBV", obv),
     ("ATR", atr),
   ]
+  # leave out indicators without a single value in the table, e.g. a newly listed stock
+  columns = columns[:1] + [c for c in columns[1:] if not isnan(c[1][-30:]).all()]
   print("| " + " | ".join([c[0] for c in columns]) + " |", file=fp)
   print("| --- " * len(columns) + "|", file=fp)
   for i in range(-1, max(-len(date), -31), -1):
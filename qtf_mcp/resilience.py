@@ -0,0 +1,244 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Deque
+
+import numpy as np
+
+logger = logging.getLogger("qtf_mcp")
+
+
+class CircuitOpenError(Exception):
+  """raised without calling MSD while the circuit breaker is open"""
+
+
+class FetchTimeoutError(Exception):
+  """raised when a fetch does not finish before its deadline"""
+
+
+class FetchBusyError(Exception):
+  """raised when too many fetches are still running, most likely hung on MSD"""
+
+
+class CircuitBreaker:
+  """
+  open after `threshold` consecutive failed calls, fail fast for `cooldown` seconds,
+  then let a single probe call through (half open) to decide whether to close again
+  """
+
+  def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+    self.threshold = threshold
+    self.cooldown = cooldown
+    self.failures = 0
+    self.opened_at = 0.0
+    self.probing = False
+    self.lock = threading.Lock()
+
+  @property
+  def state(self) -> str:
+    with self.lock:
+      return self._state()
+
+  def _state(self) -> str:
+    if self.failures < self.threshold:
+      return "closed"
+    if time.monotonic() - self.opened_at >= self.cooldown:
+      return "half_open"
+    return "open"
+
+  def acquire(self) -> str | None:
+    """
+    return "closed" for a normal call, "probe" for the half open probe, None to fail fast
+    """
+    with self.lock:
+      state = self._state()
+      if state == "closed":
+        return state
+      if state == "half_open" and not self.probing:
+        self.probing = True
+        return "probe"
+      return None
+
+  def success(self):
+    with self.lock:
+      self.failures = 0
+      self.probing = False
+
+  def release(self):
+    """
+    end a call that says nothing about the backend, keeping the failure count
+    """
+    with self.lock:
+      self.probing = False
+
+  def failure(self):
+    with self.lock:
+      self.failures += 1
+      self.probing = False
+      if self.failures >= self.threshold:
+        self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+  """
+  keep recent successful latencies to derive the hedge delay
+  """
+
+  def __init__(self, size: int = 200, min_samples: int = 20):
+    self.samples: Deque[float] = deque(maxlen=size)
+    self.min_samples = min_samples
+    self.lock = threading.Lock()
+
+  def record(self, seconds: float):
+    with self.lock:
+      self.samples.append(seconds)
+
+  def percentile(self, q: float) -> float | None:
+    with self.lock:
+      if len(self.samples) < self.min_samples:
+        return None
+      return float(np.percentile(list(self.samples), q))
+
+
+class ResilientFetcher:
+  """
+  wrap a blocking fetch function with
+  - a deadline per attempt and an overall deadline per call
+  - a hedged second request once the attempt is slower than the p95 latency
+  - bounded retries with exponential backoff and jitter
+  - a circuit breaker to fail fast while the backend is down
+
+  every error is retried and counts as one breaker failure per call, except `bad_request`
+  errors, which are known to be caused by the query and are raised right away.
+
+  a running fetch can not be cancelled, so every fetch gets its own thread and at most
+  `max_running` may be in flight, hung ones included. at the limit a call raises
+  FetchBusyError at once, without backoff and without counting against the breaker, and
+  slow attempts are not hedged. only the half open probe may go beyond the limit
+  """
+
+  def __init__(
+    self,
+    fetch: Callable[..., Any],
+    timeout: float = 10.0,
+    total_timeout: float = 15.0,
+    retries: int = 2,
+    backoff: float = 0.2,
+    hedge_delay: float = 1.0,
+    hedge_percentile: float = 95,
+    breaker: CircuitBreaker | None = None,
+    max_running: int = 16,
+    bad_request: tuple[type[BaseException], ...] = (),
+  ):
+    self.fetch = fetch
+    self.timeout = timeout
+    self.total_timeout = total_timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.hedge_delay = hedge_delay
+    self.hedge_percentile = hedge_percentile
+    self.breaker = breaker if breaker is not None else CircuitBreaker()
+    self.latency = LatencyTracker()
+    self.max_running = max_running
+    self.bad_request = bad_request
+    self.running = 0
+    self.lock = threading.Lock()
+
+  def current_hedge_delay(self) -> float:
+    p = self.latency.percentile(self.hedge_percentile)
+    delay = self.hedge_delay if p is None else p
+    return min(delay, self.timeout)
+
+  def _submit(self, args: tuple, probe: bool = False) -> Future | None:
+    with self.lock:
+      if self.running >= self.max_running and not probe:
+        return None
+      self.running += 1
+
+    future: Future = Future()
+
+    def run():
+      try:
+        t1 = time.monotonic()
+        result = self.fetch(*args)
+        self.latency.record(time.monotonic() - t1)
+        future.set_result(result)
+      except BaseException as e:
+        future.set_exception(e)
+      finally:
+        with self.lock:
+          self.running -= 1
+
+    threading.Thread(target=run, name="msd-fetch", daemon=True).start()
+    return future
+
+  def _attempt(self, args: tuple, call_deadline: float, probe: bool) -> Any:
+    start = time.monotonic()
+    deadline = min(start + self.timeout, call_deadline)
+    hedge_at = start + self.current_hedge_delay()
+    first = self._submit(args, probe)
+    if first is None:
+      raise FetchBusyError(f"{self.running} msd fetches still running")
+    pending: set[Future] = {first}
+    hedged = False
+    error: BaseException | None = None
+
+    while pending:
+      now = time.monotonic()
+      if now >= deadline:
+        break
+      until = deadline if hedged else min(hedge_at, deadline)
+      done, pending = wait(pending, timeout=until - now, return_when=FIRST_COMPLETED)
+      for f in done:
+        if f.exception() is None:
+          return f.result()
+        error = f.exception()
+      if not hedged and pending and time.monotonic() >= hedge_at:
+        # never hedge the probe, and only while there is room for another fetch
+        hedged = True
+        hedge = None if probe else self._submit(args)
+        if hedge is not None:
+          logger.info(f"msd fetch slower than {hedge_at - start:.3f} seconds, hedging")
+          pending.add(hedge)
+
+    if not pending and error is not None:
+      raise error
+    raise FetchTimeoutError(f"msd fetch did not finish in {deadline - start:.3f} seconds")
+
+  def __call__(self, *args) -> Any:
+    state = self.breaker.acquire()
+    if state is None:
+      raise CircuitOpenError("msd circuit breaker is open")
+    probe = state == "probe"
+    call_deadline = time.monotonic() + self.total_timeout
+
+    attempt = 0
+    error: Exception | None = None
+    while True:
+      try:
+        result = self._attempt(args, call_deadline, probe)
+      except FetchBusyError:
+        # no room to run the fetch, this says nothing about msd unless an attempt failed before
+        if error is None:
+          self.breaker.release()
+          raise
+        self.breaker.failure()
+        raise error
+      except self.bad_request:
+        self.breaker.release()
+        raise
+      except Exception as e:
+        error = e
+        logger.warning(f"msd fetch attempt {attempt + 1} failed: {e!r}")
+        delay = self.backoff * (2**attempt) * random.uniform(0.5, 1.5)
+        if attempt >= self.retries or probe or time.monotonic() + delay >= call_deadline:
+          self.breaker.failure()
+          raise
+        time.sleep(delay)
+        attempt += 1
+        continue
+      self.breaker.success()
+      return result
@@ -0,0 +1,143 @@
+import gzip
+import importlib
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MSD_HOST", "fake")
+os.environ.setdefault("STOCK_TO_SECTOR_DATA", os.path.join(ROOT, "confs/stock_sector.json"))
+
+from mcp.server.fastmcp import FastMCP
+from starlette.testclient import TestClient
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from bench_resample import fake_daily
+from qtf_mcp import research
+
+app_module = importlib.import_module("qtf_mcp.mcp_app")
+mcp_app = app_module.mcp_app
+
+SYMBOL = "SH000001"
+RENDERS = 0
+
+
+KLINE = fake_daily(500)
+
+
+async def fake_load_raw_data(symbol: str, end_date=None, who: str = "", timeframe: str = "1d"):
+  # a fresh dict per call like a real fetch, with the same data so the data version repeats
+  kline = {field: arr.copy() for field, arr in KLINE.items()}
+  data = dict(kline)
+  data["CLOSE2"] = kline["CLOSE"]
+  data["SECTOR"] = ["银行"]  # type: ignore
+  data["_DS_KLINE"] = (kline, "1d")  # type: ignore
+  return data
+
+
+build_technical_data = research.build_technical_data
+
+
+def counting_build_technical_data(*args, **kwargs):
+  global RENDERS
+  RENDERS += 1
+  return build_technical_data(*args, **kwargs)
+
+
+research.load_raw_data = fake_load_raw_data  # type: ignore
+research.build_technical_data = counting_build_technical_data  # type: ignore
+
+
+class ServerCPU:
+  """
+  sum the CPU time of the server event loop thread while it serves http requests,
+  the TestClient runs the app on its own thread so client work is not counted
+  """
+
+  def __init__(self, app: ASGIApp):
+    self.app = app
+    self.seconds = 0.0
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    t1 = time.thread_time()
+    try:
+      await self.app(scope, receive, send)
+    finally:
+      self.seconds += time.thread_time() - t1
+
+
+def response_json(raw: bytes, content_type: str) -> dict:
+  if content_type.startswith("text/event-stream"):
+    for line in raw.decode().splitlines():
+      if line.startswith("data:"):
+        return json.loads(line[5:])
+    raise AssertionError("no data in event stream")
+  return json.loads(raw)
+
+
+def run(name: str, compressed: bool, encoding: str, n: int = 200) -> str:
+  global RENDERS
+  RENDERS = 0
+  app_module.REPORT_CACHE.clear()
+  app_module.REPORT_CACHE_SIZE = 256 if compressed else 0
+  # the baseline transport: every tool result streamed as an SSE event, no middleware
+  mcp_app.settings.json_response = compressed
+  # every streamable http app gets its own session manager, it can only run once
+  mcp_app._session_manager = None
+  if compressed:
+    app = mcp_app.streamable_http_app()
+  else:
+    app = FastMCP.streamable_http_app(mcp_app)
+  meter = ServerCPU(app)
+
+  headers = {
+    "accept": "application/json, text/event-stream",
+    "accept-encoding": encoding,
+  }
+  wire = 0
+  text = ""
+  versions = set()
+  with TestClient(meter, base_url="http://127.0.0.1:8000") as client:
+    for i in range(n):
+      # a long lived client numbers its requests, so no two bodies are the same
+      payload = {
+        "jsonrpc": "2.0",
+        "id": i + 1,
+        "method": "tools/call",
+        "params": {"name": "full", "arguments": {"symbol": SYMBOL}},
+      }
+      with client.stream("POST", "/cnstock/mcp", json=payload, headers=headers) as r:
+        raw = b"".join(r.iter_raw())
+      assert r.status_code == 200, r.status_code
+      wire += len(raw)
+      content_encoding = r.headers.get("content-encoding", "identity")
+      if content_encoding == "gzip":
+        raw = gzip.decompress(raw)
+      if content_encoding in ("gzip", "identity"):
+        message = response_json(raw, r.headers.get("content-type", ""))
+        assert message["id"] == i + 1, message["id"]
+        text = message["result"]["content"][0]["text"]
+        versions.add((message["result"].get("_meta") or {}).get("data_version", None))
+  print(
+    f"{name}: {wire / n:.0f} bytes/request, {meter.seconds / n * 1000:.3f} ms server cpu/request, {RENDERS} renders, data versions {sorted(map(str, versions))}"
+  )
+  return text
+
+
+if __name__ == "__main__":
+  n = 200
+  before = run("before (sse)", False, "identity", n)
+  assert RENDERS == n, "every call renders without the report cache"
+  after = run("after (gzip)", True, "gzip", n)
+  assert RENDERS == 1, "identical calls reuse the rendered report"
+  assert after == before
+  # the cached report is spliced into gzip, zstd is only used for other responses
+  run("after (zstd, gzip)", True, "zstd, gzip", n)
+  assert RENDERS == 1
+  run("after (zstd)", True, "zstd", n)
+  assert RENDERS == 1
@@ -0,0 +1,230 @@
+import os
+import random
+import sys
+import threading
+import time
+from io import StringIO
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MSD_HOST", "fake")
+os.environ.setdefault("STOCK_TO_SECTOR_DATA", os.path.join(ROOT, "confs/stock_sector.json"))
+
+import numpy as np
+
+from bench_resample import fake_daily
+from qtf_mcp import datafeed, research
+from qtf_mcp.resilience import CircuitBreaker, CircuitOpenError, FetchBusyError, ResilientFetcher
+
+
+class FakeMSD:
+  """
+  stands in for msd_fetch_once, most calls are fast, some stall and some fail
+  """
+
+  def __init__(self, fast: float, slow: float, slow_rate: float, error_rate: float):
+    self.fast = fast
+    self.slow = slow
+    self.slow_rate = slow_rate
+    self.error_rate = error_rate
+    self.down = False
+    self.hang = False
+    self.release = threading.Event()
+    self.calls = 0
+
+  def __call__(self, url: str, sqls: dict) -> dict:
+    self.calls += 1
+    if self.hang:
+      self.release.wait()
+      raise ConnectionError("msd connection reset")
+    if self.down:
+      time.sleep(self.fast)
+      raise ConnectionError("msd is down")
+    r = random.random()
+    if r < self.error_rate:
+      time.sleep(self.fast)
+      raise ConnectionError("injected error")
+    time.sleep(self.slow if r < self.error_rate + self.slow_rate else self.fast)
+    return {"SH600000.KLINE.DATE": np.arange(10)}
+
+
+def run(fetch, n: int) -> tuple[np.ndarray, int]:
+  latency = []
+  errors = 0
+  for _ in range(n):
+    t1 = time.perf_counter()
+    try:
+      fetch("msd://fake", {})
+    except Exception:
+      errors += 1
+    latency.append(time.perf_counter() - t1)
+  return np.array(latency) * 1000, errors
+
+
+def report(name: str, latency: np.ndarray, errors: int):
+  p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+  print(f"{name}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, errors {errors}/{len(latency)}")
+
+
+def check_recovery():
+  """
+  hung fetches keep their threads, the breaker must still close once msd answers again.
+  busy calls do not count against the breaker, so the first hung call opens it
+  """
+  msd = FakeMSD(fast=0.01, slow=0.5, slow_rate=0, error_rate=0)
+  msd.hang = True
+  breaker = CircuitBreaker(threshold=1, cooldown=0.5)
+  fetcher = ResilientFetcher(
+    msd, timeout=0.1, total_timeout=0.5, retries=2, backoff=0.01, breaker=breaker, max_running=4
+  )
+  for _ in range(10):
+    try:
+      fetcher("msd://fake", {})
+    except Exception:
+      pass
+  assert breaker.state == "open", breaker.state
+  assert fetcher.running <= 4, fetcher.running
+
+  msd.hang = False
+  time.sleep(0.6)
+  result = fetcher("msd://fake", {})
+  assert "SH600000.KLINE.DATE" in result
+  assert breaker.state == "closed", breaker.state
+  print(f"recovery: breaker closed with {fetcher.running} fetches still hung")
+  msd.release.set()
+
+
+def check_error_kinds():
+  """
+  unknown errors are retried and open the breaker, bad requests and busy calls are raised at once
+  """
+  calls = 0
+
+  def broken(url: str, sqls: dict) -> dict:
+    nonlocal calls
+    calls += 1
+    raise RuntimeError("connection refused")
+
+  breaker = CircuitBreaker(threshold=3, cooldown=60)
+  fetcher = ResilientFetcher(broken, retries=2, backoff=0.001, breaker=breaker)
+  for _ in range(20):
+    try:
+      fetcher("msd://fake", {})
+    except (RuntimeError, CircuitOpenError):
+      pass
+  assert calls == 3 * 3, calls
+  assert breaker.state == "open", breaker.state
+
+  calls = 0
+
+  def bad_query(url: str, sqls: dict) -> dict:
+    nonlocal calls
+    calls += 1
+    raise ValueError("no such table")
+
+  breaker = CircuitBreaker(threshold=3, cooldown=60)
+  fetcher = ResilientFetcher(bad_query, retries=2, breaker=breaker, bad_request=(ValueError,))
+  for _ in range(10):
+    try:
+      fetcher("msd://fake", {})
+    except ValueError:
+      pass
+  assert calls == 10, calls
+  assert breaker.state == "closed", breaker.state
+
+  msd = FakeMSD(fast=0.01, slow=0.5, slow_rate=0, error_rate=0)
+  msd.hang = True
+  breaker = CircuitBreaker(threshold=1, cooldown=60)
+  fetcher = ResilientFetcher(msd, timeout=0.05, total_timeout=0.2, breaker=breaker, max_running=1)
+
+  def hung_call():
+    try:
+      fetcher("msd://fake", {})
+    except Exception:
+      pass
+
+  threading.Thread(target=hung_call, daemon=True).start()
+  time.sleep(0.02)
+  t1 = time.perf_counter()
+  try:
+    fetcher("msd://fake", {})
+    raise AssertionError("a call beyond max_running must fail")
+  except FetchBusyError:
+    pass
+  elapsed = (time.perf_counter() - t1) * 1000
+  assert elapsed < 20, elapsed
+  msd.release.set()
+  print(f"error kinds: unknown errors retried, bad requests not, busy failed in {elapsed:.2f} ms")
+
+
+def check_stale_fallback():
+  """
+  a failed fetch serves the last good data of a covering range, marked as stale
+  """
+  symbol = "SH000001"
+  daily = fake_daily(300)
+  raw = {f"{symbol}.KLINE.{field}": arr for field, arr in daily.items()}
+
+  datafeed.msd_fetch = lambda url, sqls: raw  # type: ignore
+  fresh = datafeed.load_data_msd_batch([symbol], "2024-01-01", "2099-01-01")[symbol]
+  assert "_STALE" not in fresh
+
+  def down(url: str, sqls: dict) -> dict:
+    raise ConnectionError("msd is down")
+
+  datafeed.msd_fetch = down  # type: ignore
+  stale = datafeed.load_data_msd_batch([symbol], "2024-06-01", "2099-01-01")[symbol]
+  assert stale["_STALE"] > 0
+  assert np.array_equal(stale["CLOSE"], fresh["CLOSE"])
+  buf = StringIO()
+  research.build_basic_data(buf, symbol, stale)
+  assert "行情服务暂不可用" in buf.getvalue()
+
+  # longer history than cached, a historical end date and an unknown symbol all raise
+  for symbols, start_date, end_date in [
+    ([symbol], "2020-01-01", "2099-01-01"),
+    ([symbol], "2024-06-01", "2025-01-01"),
+    (["SZ399001"], "2024-01-01", "2099-01-01"),
+  ]:
+    try:
+      datafeed.load_data_msd_batch(symbols, start_date, end_date)
+    except ConnectionError:
+      continue
+    raise AssertionError(f"stale data served for {symbols} {start_date} {end_date}")
+  print("stale fallback: served and marked, uncovered ranges raise")
+
+
+if __name__ == "__main__":
+  random.seed(0)
+  n = 400
+  msd = FakeMSD(fast=0.01, slow=0.5, slow_rate=0.02, error_rate=0.02)
+
+  direct = run(msd, n)
+  report("direct", *direct)
+
+  fetcher = ResilientFetcher(msd, timeout=1.0, retries=2, backoff=0.01, hedge_delay=0.05)
+  resilient = run(fetcher, n)
+  report("resilient", *resilient)
+  assert resilient[1] == 0, "transient errors must be retried"
+  assert np.percentile(resilient[0], 99) < np.percentile(direct[0], 99), "hedging must cut p99"
+  print(f"resilient hedge delay after warmup: {fetcher.current_hedge_delay() * 1000:.1f} ms")
+
+  # outage: the breaker opens and later calls fail fast without touching MSD
+  msd.down = True
+  breaker = CircuitBreaker(threshold=3, cooldown=60)
+  fetcher = ResilientFetcher(msd, timeout=1.0, retries=2, backoff=0.01, breaker=breaker)
+  calls = msd.calls
+  t1 = time.perf_counter()
+  for _ in range(50):
+    try:
+      fetcher("msd://fake", {})
+    except (CircuitOpenError, ConnectionError):
+      pass
+  elapsed = (time.perf_counter() - t1) * 1000
+  print(f"outage: 50 requests in {elapsed:.1f} ms, {msd.calls - calls} reached msd, breaker {breaker.state}")
+  assert breaker.state == "open"
+  assert msd.calls - calls <= 3 * 3, "only calls before the breaker opens reach msd"
+
+  check_recovery()
+  check_error_kinds()
+  check_stale_fallback()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MSD_HOST", "localhost")
+
+import numpy as np
+
+from qtf_mcp.datafeed import period_starts, resample_arrays
+
+
+def fake_daily(n: int) -> dict[str, np.ndarray]:
+  # trading days only, local midnight stored as UTC epoch nanoseconds
+  days = np.busday_offset("2000-01-03", np.arange(n), roll="forward")
+  dates = (days.astype("datetime64[ns]") - np.timedelta64(8, "h")).astype(np.int64)
+  rng = np.random.default_rng(0)
+  close = 10 + np.cumsum(rng.normal(0, 0.1, n))
+  return {
+    "DATE": dates,
+    "OPEN": close + rng.normal(0, 0.05, n),
+    "HIGH": close + 0.2,
+    "LOW": close - 0.2,
+    "CLOSE": close,
+    "VOLUME": rng.uniform(1e6, 2e6, n),
+    "AMOUNT": rng.uniform(1e7, 2e7, n),
+  }
+
+
+def naive_resample(data: dict[str, np.ndarray], timeframe: str) -> dict[str, np.ndarray]:
+  import datetime
+
+  rows = []
+  last_key = None
+  for i in range(len(data["DATE"])):
+    d = datetime.datetime.fromtimestamp(data["DATE"][i] / 1e9, datetime.timezone(datetime.timedelta(hours=8)))
+    key = d.isocalendar()[:2] if timeframe == "1w" else (d.year, d.month)
+    if key != last_key:
+      rows.append({f: data[f][i] for f in data})
+      last_key = key
+    else:
+      row = rows[-1]
+      row["DATE"] = data["DATE"][i]
+      row["HIGH"] = max(row["HIGH"], data["HIGH"][i])
+      row["LOW"] = min(row["LOW"], data["LOW"][i])
+      row["CLOSE"] = data["CLOSE"][i]
+      row["VOLUME"] += data["VOLUME"][i]
+      row["AMOUNT"] += data["AMOUNT"][i]
+  return {f: np.array([r[f] for r in rows]) for f in data}
+
+
+def bench(fn, repeat: int = 20) -> float:
+  t1 = time.perf_counter()
+  for _ in range(repeat):
+    fn()
+  return (time.perf_counter() - t1) / repeat * 1000
+
+
+if __name__ == "__main__":
+  for n in [500, 5000]:
+    data = fake_daily(n)
+    for tf in ["1w", "1M"]:
+      fast = resample_arrays(data, period_starts(data["DATE"], tf))
+      slow = naive_resample(data, tf)
+      for f in data:
+        assert np.allclose(fast[f], slow[f]), f"{tf} {f} mismatch"
+      t_fast = bench(lambda: resample_arrays(data, period_starts(data["DATE"], tf)))
+      t_slow = bench(lambda: naive_resample(data, tf))
+      print(f"{n} bars {tf}: vectorized {t_fast:.3f} ms, loop {t_slow:.3f} ms, {t_slow / t_fast:.1f}x")